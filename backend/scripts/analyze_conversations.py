@@ -2,8 +2,42 @@
 """分析LLM Gateway完整对话（请求+响应）"""
 import json
 import sys
-import re
-from collections import defaultdict
+from functools import lru_cache
+
+try:
+    import ijson
+except ImportError:  # 未安装 ijson 时所有响应都整体解析
+    ijson = None
+
+from log_ingest import Conversation, iter_events, parse_body
+
+# 响应中缺少 usage 时的只读占位
+_EMPTY_USAGE = {}
+
+# 不小于该长度的非流式响应用 ijson 增量提取文本和 usage，不构建完整对象树
+_INCREMENTAL_PARSE_MIN_LEN = 1 << 20
+
+# SSE 行前缀
+_EVENT_PREFIX = 'event:'
+_EVENT_PREFIX_LEN = len(_EVENT_PREFIX)
+_DATA_PREFIX = 'data:'
+_DATA_PREFIX_LEN = len(_DATA_PREFIX)
+
+# 网关记录的SSE响应体把各事件直接首尾相接（去掉了事件间的空行），
+# data: 之后的JSON不一定以换行结束，用 raw_decode 取出一个完整JSON值并得到其结束位置
+_SSE_DECODER = json.JSONDecoder()
+
+# SSE 事件类型（驻留字符串，比较时可走指针快速路径）
+_CONTENT_BLOCK_DELTA = sys.intern('content_block_delta')
+_MESSAGE_DELTA = sys.intern('message_delta')
+_MESSAGE_START = sys.intern('message_start')
+
+@lru_cache(maxsize=1024)
+def _truncate(text, limit):
+    """截断过长文本并注明总长度；同一系统提示词在多个对话中重复出现时直接复用结果"""
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}\n... (truncated, 总长度: {len(text)} 字符)"
 
 def parse_sse_response(sse_text):
     """解析Server-Sent Events格式的响应"""
@@ -11,150 +45,185 @@ def parse_sse_response(sse_text):
     full_text = ""
     usage = {}
 
-    # 按 "event:" 分割SSE流
-    parts = sse_text.split('event:')
-
-    for part in parts:
-        if not part.strip():
+    # 依次定位 data: 前缀，其前面最近的 event: 即该事件的类型；
+    # 解析出一个JSON值后从其结束位置继续查找，无需逐字符扫描
+    event_type = None
+    text_len = len(sse_text)
+    pos = 0
+    while True:
+        data_start = sse_text.find(_DATA_PREFIX, pos)
+        if data_start == -1:
+            break
+
+        event_start = sse_text.rfind(_EVENT_PREFIX, pos, data_start)
+        if event_start != -1:
+            name_end = sse_text.find('\n', event_start, data_start)
+            if name_end == -1:
+                name_end = data_start
+            event_type = sys.intern(sse_text[event_start + _EVENT_PREFIX_LEN:name_end].strip())
+
+        json_start = data_start + _DATA_PREFIX_LEN
+        while json_start < text_len and sse_text[json_start] in ' \t':
+            json_start += 1
+
+        try:
+            data, pos = _SSE_DECODER.raw_decode(sse_text, json_start)
+        except ValueError:
+            pos = json_start
             continue
 
-        lines = part.strip().split('\n', 1)
-        if len(lines) < 2:
+        events.append({'type': event_type, 'data': data})
+        if not isinstance(data, dict):
             continue
 
-        event_type = lines[0].strip()
-        data_part = lines[1]
-
-        if not data_part.startswith('data:'):
-            continue
-
-        # 提取JSON（去掉"data:"前缀，找到完整的JSON对象）
-        json_str = data_part.replace('data:', '', 1).strip()
-
-        # 找到完整的JSON对象（处理嵌套大括号）
-        brace_count = 0
-        json_end = 0
-        for i, char in enumerate(json_str):
-            if char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    json_end = i + 1
-                    break
-
-        if json_end > 0:
-            try:
-                data = json.loads(json_str[:json_end])
-                events.append({'type': event_type, 'data': data})
-
-                # 提取文本内容
-                if event_type == 'content_block_delta':
-                    text = data.get('delta', {}).get('text', '')
+        # 提取文本内容
+        if event_type == _CONTENT_BLOCK_DELTA:
+            delta = data.get('delta')
+            if isinstance(delta, dict):
+                text = delta.get('text')
+                if isinstance(text, str):
                     full_text += text
 
-                # 提取usage信息
-                if event_type == 'message_delta':
-                    usage = data.get('usage', {})
-                elif event_type == 'message_start':
-                    msg_usage = data.get('message', {}).get('usage', {})
-                    if msg_usage:
-                        usage.update(msg_usage)
-            except:
-                pass
+        # 提取usage信息
+        if event_type == _MESSAGE_DELTA:
+            msg_usage = data.get('usage')
+            usage = msg_usage if isinstance(msg_usage, dict) else {}
+        elif event_type == _MESSAGE_START:
+            message = data.get('message')
+            msg_usage = message.get('usage') if isinstance(message, dict) else None
+            if isinstance(msg_usage, dict) and msg_usage:
+                usage.update(msg_usage)
 
     return full_text, usage, events
 
+class _Utf8Reader:
+    """把 str 分块编码为 UTF-8 交给 ijson 读取，避免整体复制一份 bytes"""
+
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self._text) - self._pos
+        chunk = self._text[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk.encode('utf-8')
+
+def parse_json_response(body_text):
+    """解析非流式JSON格式的响应"""
+    if ijson is not None and len(body_text) >= _INCREMENTAL_PARSE_MIN_LEN:
+        text = ''.join(ijson.items(_Utf8Reader(body_text), 'content.item.text'))
+        usage = next(ijson.items(_Utf8Reader(body_text), 'usage'), {})
+        return text, usage
+
+    resp_json = parse_body(body_text)
+    text = ""
+    if 'content' in resp_json and resp_json['content']:
+        for content in resp_json['content']:
+            if isinstance(content, dict) and 'text' in content:
+                text += content['text']
+    return text, resp_json.get('usage', {})
+
 def analyze_conversations(log_file):
     """分析完整对话"""
 
-    conversations = defaultdict(lambda: {'request': None, 'response': None, 'timestamp': None})
+    # 只保留尚未配对完成的对话；配对完成后立即累计统计并移出
+    conversations = {}
+    shown_conversations = []
+    complete_count = 0
+    total_input = 0
+    total_output = 0
+    total_cache_read = 0
+    total_cache_create = 0
 
     print("=" * 100)
     print("🔍 LLM Gateway 对话分析 - 请求与响应详情")
     print("=" * 100)
 
-    # 第一遍：收集所有数据
-    with open(log_file, 'r') as f:
-        for line in f:
+    # 单遍扫描：收集数据的同时完成统计
+    for event in iter_events(log_file):
+        request_id = event.request_id
+        if not request_id:
+            continue
+
+        if event.event_type == 'request_body':
+            try:
+                body = event.parsed_body
+                conv = conversations.get(request_id)
+                if conv is None:
+                    conv = conversations[request_id] = Conversation()
+                conv.request = body
+                conv.model = event.model
+                conv.api_key = event.api_key
+                conv.timestamp = event.timestamp
+            except:
+                pass
+
+        elif event.event_type == 'response_body':
+            conv = conversations.get(request_id)
+            if conv is None:
+                conv = conversations[request_id] = Conversation()
             try:
-                log = json.loads(line.strip())
-
-                if 'fields' not in log:
-                    continue
-
-                event_type = log['fields'].get('event_type')
-                if not event_type:
-                    continue
-
-                request_id = log.get('span', {}).get('request_id')
-                if not request_id:
-                    continue
-
-                if event_type == 'request_body':
-                    try:
-                        body = json.loads(log['fields']['body'])
-                        conversations[request_id]['request'] = body
-                        conversations[request_id]['model'] = log['span'].get('model')
-                        conversations[request_id]['api_key'] = log['span'].get('api_key_name')
-                        conversations[request_id]['timestamp'] = log.get('timestamp')
-                    except:
-                        pass
-
-                elif event_type == 'response_body':
-                    try:
-                        body_text = log['fields']['body']
-                        streaming = log['fields'].get('streaming', False)
-
-                        conversations[request_id]['response_raw'] = body_text
-                        conversations[request_id]['streaming'] = streaming
-
-                        # 解析响应
-                        if streaming:
-                            # SSE格式
-                            full_text, usage, events = parse_sse_response(body_text)
-                            conversations[request_id]['response_text'] = full_text
-                            conversations[request_id]['usage'] = usage
-                        else:
-                            # 普通JSON格式
-                            resp_json = json.loads(body_text)
-                            text = ""
-                            if 'content' in resp_json and resp_json['content']:
-                                for content in resp_json['content']:
-                                    if isinstance(content, dict) and 'text' in content:
-                                        text += content['text']
-                            conversations[request_id]['response_text'] = text
-                            conversations[request_id]['usage'] = resp_json.get('usage', {})
-                    except Exception as e:
-                        conversations[request_id]['parse_error'] = str(e)
-                        pass
-
-            except json.JSONDecodeError:
-                continue
-
-    # 第二遍：输出配对的对话
-    complete_conversations = {k: v for k, v in conversations.items()
-                             if v['request'] is not None and 'response_text' in v}
-
-    print(f"\n找到 {len(complete_conversations)} 个完整对话（包含请求和响应）\n")
+                body_text = event.body
+                streaming = event.streaming
+
+                conv.streaming = streaming
+
+                # 解析响应
+                if streaming:
+                    # SSE格式
+                    full_text, usage, events = parse_sse_response(body_text)
+                    conv.response_text = full_text
+                    conv.usage = usage
+                else:
+                    # 普通JSON格式
+                    text, usage = parse_json_response(body_text)
+                    conv.response_text = text
+                    conv.usage = usage
+            except Exception as e:
+                conv.parse_error = str(e)
+                pass
+
+        else:
+            continue
+
+        # 请求和响应都已到齐：累计统计，只保留前5个用于输出详情
+        conv = conversations.get(request_id)
+        if conv is not None and conv.request is not None and conv.response_text is not None:
+            del conversations[request_id]
+            complete_count += 1
+
+            usage = conv.usage or _EMPTY_USAGE
+            total_input += usage.get('input_tokens', 0)
+            total_output += usage.get('output_tokens', 0)
+            total_cache_read += usage.get('cache_read_input_tokens', 0)
+            total_cache_create += usage.get('cache_creation_input_tokens', 0)
+
+            if len(shown_conversations) < 5:
+                shown_conversations.append((request_id, conv))
+
+    print(f"\n找到 {complete_count} 个完整对话（包含请求和响应）\n")
 
     # 输出前5个对话详情
-    for idx, (request_id, conv) in enumerate(list(complete_conversations.items())[:5], 1):
-        print(f"\n{'='*100}")
-        print(f"对话 #{idx}")
-        print(f"{'='*100}")
-        print(f"Request ID: {request_id}")
-        print(f"时间: {conv.get('timestamp', 'N/A')}")
-        print(f"模型: {conv.get('model', 'N/A')}")
-        print(f"API Key: {conv.get('api_key', 'N/A')}")
-        print(f"流式响应: {'是' if conv.get('streaming') else '否'}")
-
-        req = conv['request']
+    for idx, (request_id, conv) in enumerate(shown_conversations, 1):
+        # 每个对话的详情先拼好，再一次性写出
+        out = []
+        out.append(f"\n{'='*100}")
+        out.append(f"对话 #{idx}")
+        out.append(f"{'='*100}")
+        out.append(f"Request ID: {request_id}")
+        out.append(f"时间: {conv.timestamp}")
+        out.append(f"模型: {conv.model}")
+        out.append(f"API Key: {conv.api_key}")
+        out.append(f"流式响应: {'是' if conv.streaming else '否'}")
+
+        req = conv.request
 
         # 1. 系统提示词
-        print(f"\n{'─'*100}")
-        print("📋 系统提示词 (System Prompt)")
-        print(f"{'─'*100}")
+        out.append(f"\n{'─'*100}")
+        out.append("📋 系统提示词 (System Prompt)")
+        out.append(f"{'─'*100}")
         if 'system' in req and req['system']:
             for i, sys_msg in enumerate(req['system'], 1):
                 if isinstance(sys_msg, dict) and 'text' in sys_msg:
@@ -162,18 +231,15 @@ def analyze_conversations(log_file):
                     cache = sys_msg.get('cache_control', {}).get('type', '')
                     cache_mark = f" [🔵 Cached: {cache}]" if cache else ""
 
-                    print(f"\n系统提示 #{i}{cache_mark}:")
-                    if len(text) > 500:
-                        print(f"{text[:500]}\n... (truncated, 总长度: {len(text)} 字符)")
-                    else:
-                        print(text)
+                    out.append(f"\n系统提示 #{i}{cache_mark}:")
+                    out.append(_truncate(text, 500))
         else:
-            print("(无系统提示)")
+            out.append("(无系统提示)")
 
         # 2. 用户输入
-        print(f"\n{'─'*100}")
-        print("💬 用户输入 (User Messages)")
-        print(f"{'─'*100}")
+        out.append(f"\n{'─'*100}")
+        out.append("💬 用户输入 (User Messages)")
+        out.append(f"{'─'*100}")
         if 'messages' in req and req['messages']:
             for msg_idx, msg in enumerate(req['messages'], 1):
                 role = msg.get('role', 'unknown')
@@ -192,24 +258,21 @@ def analyze_conversations(log_file):
                     else:
                         text = str(msg['content'])
 
-                    print(f"\n消息 #{msg_idx} [{role}]:")
-                    if len(text) > 600:
-                        print(f"{text[:600]}\n... (truncated, 总长度: {len(text)} 字符)")
-                    else:
-                        print(text)
+                    out.append(f"\n消息 #{msg_idx} [{role}]:")
+                    out.append(_truncate(text, 600))
 
         # 3. 请求配置
-        print(f"\n{'─'*100}")
-        print("⚙️  请求配置")
-        print(f"{'─'*100}")
-        print(f"max_tokens: {req.get('max_tokens', 'N/A')}")
-        print(f"temperature: {req.get('temperature', 'default')}")
-        print(f"stream: {req.get('stream', False)}")
+        out.append(f"\n{'─'*100}")
+        out.append("⚙️  请求配置")
+        out.append(f"{'─'*100}")
+        out.append(f"max_tokens: {req.get('max_tokens', 'N/A')}")
+        out.append(f"temperature: {req.get('temperature', 'default')}")
+        out.append(f"stream: {req.get('stream', False)}")
 
         if 'tools' in req and req['tools']:
-            print(f"工具数量: {len(req['tools'])}")
+            out.append(f"工具数量: {len(req['tools'])}")
             if len(req['tools']) <= 10:
-                print("工具列表:")
+                out.append("工具列表:")
                 for tool in req['tools'][:10]:
                     tool_name = tool.get('name', 'unknown')
                     if tool_name.startswith('mcp__'):
@@ -219,57 +282,51 @@ def analyze_conversations(log_file):
                     desc = tool.get('description', '')
                     if len(desc) > 60:
                         desc = desc[:60] + "..."
-                    print(f"  • {tool_name}: {desc}")
+                    out.append(f"  • {tool_name}: {desc}")
 
         if 'output_config' in req:
             output_fmt = req['output_config'].get('format', {}).get('type', 'text')
-            print(f"输出格式: {output_fmt}")
+            out.append(f"输出格式: {output_fmt}")
             if output_fmt == 'json_schema':
                 schema = req['output_config']['format'].get('schema', {})
                 if 'properties' in schema:
-                    print(f"  Schema字段: {', '.join(schema['properties'].keys())}")
+                    out.append(f"  Schema字段: {', '.join(schema['properties'].keys())}")
 
         # 4. LLM响应
-        print(f"\n{'─'*100}")
-        print("🤖 LLM 响应 (Assistant Response)")
-        print(f"{'─'*100}")
-        response_text = conv.get('response_text', '')
+        out.append(f"\n{'─'*100}")
+        out.append("🤖 LLM 响应 (Assistant Response)")
+        out.append(f"{'─'*100}")
+        response_text = conv.response_text
         if response_text:
-            if len(response_text) > 800:
-                print(f"{response_text[:800]}\n... (truncated, 总长度: {len(response_text)} 字符)")
-            else:
-                print(response_text)
+            out.append(_truncate(response_text, 800))
         else:
-            print("(无响应内容或解析失败)")
+            out.append("(无响应内容或解析失败)")
 
         # 5. Token使用情况
-        if 'usage' in conv and conv['usage']:
-            usage = conv['usage']
-            print(f"\n{'─'*100}")
-            print("📊 Token 使用统计")
-            print(f"{'─'*100}")
-            print(f"输入 tokens: {usage.get('input_tokens', 0)}")
-            print(f"输出 tokens: {usage.get('output_tokens', 0)}")
+        if conv.usage:
+            usage = conv.usage
+            out.append(f"\n{'─'*100}")
+            out.append("📊 Token 使用统计")
+            out.append(f"{'─'*100}")
+            out.append(f"输入 tokens: {usage.get('input_tokens', 0)}")
+            out.append(f"输出 tokens: {usage.get('output_tokens', 0)}")
 
             if usage.get('cache_creation_input_tokens'):
-                print(f"缓存创建 tokens: {usage.get('cache_creation_input_tokens', 0)} (成本 +25%)")
+                out.append(f"缓存创建 tokens: {usage.get('cache_creation_input_tokens', 0)} (成本 +25%)")
             if usage.get('cache_read_input_tokens'):
-                print(f"缓存读取 tokens: {usage.get('cache_read_input_tokens', 0)} (成本 -90%)")
+                out.append(f"缓存读取 tokens: {usage.get('cache_read_input_tokens', 0)} (成本 -90%)")
 
             total = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
-            print(f"总计: {total} tokens")
+            out.append(f"总计: {total} tokens")
+
+        sys.stdout.write('\n'.join(out) + '\n')
 
     # 总结统计
     print(f"\n{'='*100}")
     print("📈 对话统计摘要")
     print(f"{'='*100}")
 
-    total_input = sum(conv.get('usage', {}).get('input_tokens', 0) for conv in complete_conversations.values())
-    total_output = sum(conv.get('usage', {}).get('output_tokens', 0) for conv in complete_conversations.values())
-    total_cache_read = sum(conv.get('usage', {}).get('cache_read_input_tokens', 0) for conv in complete_conversations.values())
-    total_cache_create = sum(conv.get('usage', {}).get('cache_creation_input_tokens', 0) for conv in complete_conversations.values())
-
-    print(f"总对话数: {len(complete_conversations)}")
+    print(f"总对话数: {complete_count}")
     print(f"总输入 tokens: {total_input:,}")
     print(f"总输出 tokens: {total_output:,}")
     print(f"缓存读取 tokens: {total_cache_read:,}")
@@ -1,55 +1,52 @@
 #!/usr/bin/env python3
-import json
 import sys
-from collections import defaultdict
+from itertools import islice
+
+from log_ingest import Conversation, iter_events
 
 def analyze_logs(log_file):
     """分析请求日志文件"""
 
-    conversations = defaultdict(lambda: {'request': None, 'response': None})
-
-    with open(log_file, 'r') as f:
-        for line in f:
-            try:
-                log = json.loads(line.strip())
-
-                # 只处理请求和响应事件
-                if 'event_type' not in log.get('fields', {}):
-                    continue
-
-                event_type = log['fields']['event_type']
-                if event_type not in ['request_body', 'response_body']:
-                    continue
-
-                request_id = log.get('span', {}).get('request_id')
-                if not request_id:
-                    continue
-
-                if event_type == 'request_body':
-                    body = json.loads(log['fields']['body'])
-                    conversations[request_id]['request'] = body
-                    conversations[request_id]['model'] = log['span'].get('model')
-                    conversations[request_id]['api_key'] = log['span'].get('api_key_name')
-
-                elif event_type == 'response_body':
-                    body = json.loads(log['fields']['body'])
-                    conversations[request_id]['response'] = body
-
-            except (json.JSONDecodeError, KeyError) as e:
-                continue
+    conversations = {}
+
+    for event in iter_events(log_file):
+        request_id = event.request_id
+        if not request_id:
+            continue
+
+        # body 缺失或不是合法JSON时跳过该事件
+        try:
+            if event.event_type == 'request_body':
+                body = event.parsed_body
+                conv = conversations.get(request_id)
+                if conv is None:
+                    conv = conversations[request_id] = Conversation()
+                conv.request = body
+                conv.model = event.model
+                conv.api_key = event.api_key
+
+            elif event.event_type == 'response_body':
+                body = event.parsed_body
+                conv = conversations.get(request_id)
+                if conv is None:
+                    conv = conversations[request_id] = Conversation()
+                conv.response = body
+
+        except (ValueError, TypeError):
+            continue
 
     # 输出分析结果
     print(f"找到 {len(conversations)} 个对话\n")
     print("=" * 100)
 
-    for idx, (request_id, data) in enumerate(list(conversations.items())[:5], 1):
+    for idx, (request_id, data) in enumerate(islice(conversations.items(), 5), 1):
         print(f"\n对话 #{idx} (Request ID: {request_id[:8]}...)")
         print("-" * 100)
 
-        if data['request']:
-            req = data['request']
-            print(f"模型: {data.get('model', 'N/A')}")
-            print(f"API Key: {data.get('api_key', 'N/A')}")
+        if data.request:
+            req = data.request
+            print(f"模型: {data.model}")
+            print(f"API Key: {data.api_key}")
 
             # 系统提示
             if 'system' in req and req['system']:
@@ -86,8 +83,8 @@ def analyze_logs(log_file):
                     for tool in req['tools']:
                         print(f"  - {tool.get('name', 'unknown')}")
 
-        if data['response']:
-            resp = data['response']
+        if data.response:
+            resp = data.response
             print(f"\n【LLM响应】:")
 
             # 响应内容
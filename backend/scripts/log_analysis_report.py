@@ -1,14 +1,92 @@
 #!/usr/bin/env python3
 """分析LLM Gateway日志文件"""
-import json
+import os
 import sys
 from collections import defaultdict, Counter
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+
+from log_ingest import chunk_offsets, iter_events, safe_parse_body
+
+# 模型/API Key/交互类型只列出出现次数最多的前 N 项
+_TOP_N = 20
+
+# 小于该大小的日志直接单进程扫描，避免进程池的启动开销
+_PARALLEL_MIN_SIZE = 16 << 20
+
+def _scan_chunk(args):
+    """扫描 [start, end) 字节范围内的日志行，返回该段的局部统计"""
+    log_file, start, end = args
+
+    total_requests = 0
+    conversations = {}
+    errors = []
+
+    # 扫描时只收集原始值，最后一次性交给 Counter 计数
+    model_names = []
+    api_key_names = []
+    error_messages = []
+
+    for event in iter_events(log_file, start, end):
+        # 统计错误
+        if event.level == 'ERROR':
+            errors.append({
+                'time': event.timestamp,
+                'message': event.message,
+                'target': event.target
+            })
+            error_messages.append(event.message)
+
+        # 处理请求body事件
+        if event.event_type == 'request_body':
+            total_requests += 1
+            request_id = event.request_id
+
+            # body 缺失或不是合法JSON对象时跳过，不计入模型/API Key 统计
+            body, parse_error = safe_parse_body(event.body)
+            if parse_error is not None or not isinstance(body, dict):
+                continue
+
+            model = body.get('model', 'unknown')
+            model_names.append(model)
+
+            api_key = event.api_key if event.api_key is not None else 'unknown'
+            api_key_names.append(api_key)
+
+            conversations[request_id] = {
+                'model': model,
+                'api_key': api_key,
+                'request': body,
+                'timestamp': event.timestamp
+            }
+
+    return {
+        'total_requests': total_requests,
+        'models': Counter(model_names),
+        'api_keys': Counter(api_key_names),
+        'errors': Counter(error_messages),
+        'error_list': errors,
+        'conversations': conversations,
+    }
 
 def analyze_detailed_logs(log_file):
     """详细分析日志文件"""
 
-    request_bodies = []
+    print("=" * 100)
+    print("LLM Gateway 日志分析报告")
+    print("=" * 100)
+
+    # 大文件按行对齐切块并行解析，小文件直接单进程扫描
+    nproc = cpu_count()
+    if nproc > 1 and os.stat(log_file).st_size >= _PARALLEL_MIN_SIZE:
+        chunks = [(log_file, start, end) for start, end in chunk_offsets(log_file, nproc)]
+        with Pool(nproc) as pool:
+            partials = pool.map(_scan_chunk, chunks)
+    else:
+        partials = [_scan_chunk((log_file, 0, os.stat(log_file).st_size))]
+
+    # 按文件顺序在一次遍历中合并各段结果，保持与顺序扫描一致的输出
     conversations = defaultdict(dict)
     errors = []
     stats = {
@@ -17,56 +95,13 @@ def analyze_detailed_logs(log_file):
         'api_keys': Counter(),
         'errors': Counter(),
     }
-
-    print("=" * 100)
-    print("LLM Gateway 日志分析报告")
-    print("=" * 100)
-
-    with open(log_file, 'r') as f:
-        for line in f:
-            try:
-                log = json.loads(line.strip())
-
-                # 统计错误
-                if log.get('level') == 'ERROR':
-                    error_msg = log.get('fields', {}).get('message', '')
-                    errors.append({
-                        'time': log.get('timestamp'),
-                        'message': error_msg,
-                        'target': log.get('target')
-                    })
-                    stats['errors'][error_msg] += 1
-
-                # 处理请求body事件
-                if log.get('fields', {}).get('event_type') == 'request_body':
-                    stats['total_requests'] += 1
-                    request_id = log.get('span', {}).get('request_id')
-
-                    try:
-                        body = json.loads(log['fields']['body'])
-                        model = body.get('model', 'unknown')
-                        stats['models'][model] += 1
-
-                        api_key = log.get('span', {}).get('api_key_name', 'unknown')
-                        stats['api_keys'][api_key] += 1
-
-                        conversations[request_id] = {
-                            'model': model,
-                            'api_key': api_key,
-                            'request': body,
-                            'timestamp': log.get('timestamp')
-                        }
-
-                        request_bodies.append({
-                            'request_id': request_id,
-                            'model': model,
-                            'body': body
-                        })
-                    except:
-                        pass
-
-            except json.JSONDecodeError:
-                continue
+    for partial in partials:
+        conversations.update(partial['conversations'])
+        errors.extend(partial['error_list'])
+        stats['total_requests'] += partial['total_requests']
+        stats['models'].update(partial['models'])
+        stats['api_keys'].update(partial['api_keys'])
+        stats['errors'].update(partial['errors'])
 
     # 输出统计信息
     print(f"\n📊 统计概览")
@@ -74,10 +109,10 @@ def analyze_detailed_logs(log_file):
     print(f"总请求数: {stats['total_requests']}")
     print(f"错误数: {sum(stats['errors'].values())}")
     print(f"\n使用的模型:")
-    for model, count in stats['models'].most_common():
+    for model, count in stats['models'].most_common(_TOP_N):
         print(f"  - {model}: {count} 次")
     print(f"\nAPI Keys:")
-    for key, count in stats['api_keys'].most_common():
+    for key, count in stats['api_keys'].most_common(_TOP_N):
         print(f"  - {key}: {count} 次")
 
     # 输出错误信息
@@ -94,7 +129,7 @@ def analyze_detailed_logs(log_file):
     print(f"\n💬 对话详情 (前5个)")
     print("=" * 100)
 
-    for idx, (request_id, data) in enumerate(list(conversations.items())[:5], 1):
+    for idx, (request_id, data) in enumerate(islice(conversations.items(), 5), 1):
         print(f"\n【对话 #{idx}】")
         print(f"Request ID: {request_id}")
         print(f"时间: {data.get('timestamp', 'N/A')}")
@@ -214,7 +249,7 @@ def analyze_detailed_logs(log_file):
     print(f"  - 使用prompt缓存: {has_cache}/{len(conversations)} ({has_cache/len(conversations)*100:.1f}%)")
 
     print(f"\n交互类型分布:")
-    for itype, count in interaction_types.most_common():
+    for itype, count in interaction_types.most_common(_TOP_N):
         print(f"  - {itype}: {count} 次")
 
     print("\n" + "=" * 100)
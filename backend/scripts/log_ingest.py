@@ -0,0 +1,136 @@
+"""LLM Gateway 日志读取公共模块：扫描JSONL日志并产出事件，供各分析脚本复用"""
+try:
+    import orjson as _json
+except ImportError:  # orjson 不可用时回退到标准库
+    import json as _json
+import os
+from collections import namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+# 读取日志时使用 1MB 缓冲区，合并磁盘 I/O
+READ_BUFFER_SIZE = 1 << 20
+
+# 重复出现的小 body（心跳、重试等）按内容缓存解析结果；大 body 不进缓存以免占用内存
+_BODY_CACHE_MAX_LEN = 32 * 1024
+
+# 分析脚本关心的 body 事件类型
+_BODY_EVENTS = frozenset({'request_body', 'response_body'})
+
+# 解析前的子串预筛：不含这些字节串的行不可能是关心的事件，直接跳过JSON解析。
+# 预筛只决定是否解析，命中的行仍按 event_type/level 精确过滤
+_REQUEST_NEEDLE = b'request_body'
+_RESPONSE_NEEDLE = b'response_body'
+_ERROR_NEEDLE = b'"ERROR"'
+
+# 缺失 fields/span 时的只读占位，避免每行新建空 dict
+_EMPTY_DICT = {}
+
+@lru_cache(maxsize=4096)
+def _parse_cached_body(body):
+    return _json.loads(body)
+
+def parse_body(body):
+    """解析日志中的 body 字段"""
+    if len(body) < _BODY_CACHE_MAX_LEN:
+        return _parse_cached_body(body)
+    return _json.loads(body)
+
+def safe_parse_body(body):
+    """解析 body 字段，返回 (对象, 错误信息)；明显不是JSON的 body 不进入解析"""
+    if not isinstance(body, str) or body[:1] not in ('{', '['):
+        return None, 'body is not a JSON object or array'
+    try:
+        return parse_body(body), None
+    except ValueError as e:
+        return None, str(e)
+
+class Event(namedtuple('Event', [
+    'request_id', 'event_type', 'timestamp', 'model', 'api_key',
+    'body', 'streaming', 'level', 'message', 'target',
+])):
+    """一条请求/响应 body 事件或 ERROR 日志；body 保持原始文本，按需解析"""
+    __slots__ = ()
+
+    @property
+    def parsed_body(self):
+        return parse_body(self.body)
+
+@dataclass(slots=True)
+class Conversation:
+    """按 request_id 配对的一次对话；未出现的字段保持为 None"""
+    request: Optional[dict] = None
+    response: Optional[dict] = None
+    model: Optional[str] = None
+    api_key: Optional[str] = None
+    timestamp: Optional[str] = None
+    streaming: bool = False
+    response_text: Optional[str] = None
+    usage: Optional[dict] = None
+    parse_error: Optional[str] = None
+
+def chunk_offsets(log_file, nchunks):
+    """把文件按字节均分为 nchunks 段，每个切分点对齐到下一行开头"""
+    size = os.stat(log_file).st_size
+    offsets = [0]
+    with open(log_file, 'rb') as f:
+        for i in range(1, nchunks):
+            f.seek(size * i // nchunks)
+            f.readline()
+            pos = f.tell()
+            if pos > offsets[-1]:
+                offsets.append(pos)
+    if offsets[-1] < size:
+        offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+def iter_events(log_file, start=0, end=None):
+    """扫描 [start, end) 字节范围内的日志行，产出 body 事件和 ERROR 日志"""
+    if end is None:
+        end = float('inf')
+
+    # 热循环内用到的全局名绑定为局部变量
+    loads = _json.loads
+    decode_error = _json.JSONDecodeError
+    body_events = _BODY_EVENTS
+    empty = _EMPTY_DICT
+    request_needle = _REQUEST_NEEDLE
+    response_needle = _RESPONSE_NEEDLE
+    error_needle = _ERROR_NEEDLE
+
+    with open(log_file, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if pos >= end:
+                break
+            pos += len(line)
+
+            if not (request_needle in line or response_needle in line or error_needle in line):
+                continue
+
+            try:
+                log = loads(line)
+            except decode_error:
+                continue
+
+            fields = log.get('fields') or empty
+            event_type = fields.get('event_type')
+            level = log.get('level')
+            if event_type not in body_events and level != 'ERROR':
+                continue
+
+            span = log.get('span') or empty
+            yield Event(
+                span.get('request_id'),
+                event_type,
+                log.get('timestamp'),
+                span.get('model'),
+                span.get('api_key_name'),
+                fields.get('body'),
+                fields.get('streaming', False),
+                level,
+                fields.get('message', ''),
+                log.get('target'),
+            )
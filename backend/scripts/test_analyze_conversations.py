@@ -0,0 +1,58 @@
+"""analyze_conversations 中SSE响应解析的回归测试"""
+from analyze_conversations import parse_sse_response
+
+# 网关记录的流式响应体：各事件去掉结尾空行后直接拼接
+CONCATENATED_SSE = (
+    'event: message_start\n'
+    'data: {"type":"message_start","message":{"usage":{"input_tokens":5,"output_tokens":1}}}'
+    'event: content_block_delta\n'
+    'data: {"type":"content_block_delta","delta":{"type":"text_delta","text":"Hello"}}'
+    'event: content_block_delta\n'
+    'data: {"type":"content_block_delta","delta":{"type":"text_delta","text":" world"}}'
+    'event: message_delta\n'
+    'data: {"type":"message_delta","usage":{"output_tokens":7}}'
+    'event: message_stop\n'
+    'data: {"type":"message_stop"}'
+)
+
+def test_concatenated_events():
+    text, usage, events = parse_sse_response(CONCATENATED_SSE)
+    assert text == "Hello world"
+    assert usage == {'output_tokens': 7}
+    assert [e['type'] for e in events] == [
+        'message_start', 'content_block_delta', 'content_block_delta',
+        'message_delta', 'message_stop',
+    ]
+
+def test_newline_separated_events():
+    sse = CONCATENATED_SSE.replace('}event:', '}\n\nevent:')
+    text, usage, _ = parse_sse_response(sse)
+    assert text == "Hello world"
+    assert usage == {'output_tokens': 7}
+
+def test_braces_inside_text():
+    sse = (
+        'event: content_block_delta\n'
+        'data: {"delta":{"text":"a { b"}}'
+        'event: content_block_delta\n'
+        'data: {"delta":{"text":" } c"}}'
+    )
+    text, _, _ = parse_sse_response(sse)
+    assert text == "a { b } c"
+
+def test_malformed_events_are_skipped():
+    sse = (
+        'event: ping\n'
+        'data: 3'
+        'event: content_block_delta\n'
+        'data: {"delta":null}'
+        'event: content_block_delta\n'
+        'data: {not json'
+        'event: content_block_delta\n'
+        'data: {"delta":{"text":"ok"}}'
+        'event: message_delta\n'
+        'data: {"usage":null}'
+    )
+    text, usage, _ = parse_sse_response(sse)
+    assert text == "ok"
+    assert usage == {}